@@ -0,0 +1,91 @@
+#
+# Copyright (C) 2024, HENSOLDT Cyber GmbH
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+# For commercial licensing, contact: info.cyber@hensoldt.net
+#
+
+
+import gzip
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# ===============================================================================
+# COMPRESSION
+# ===============================================================================
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+MAGIC_SIZE = max(len(GZIP_MAGIC), len(ZSTD_MAGIC))
+
+
+def supported_encodings():
+    return ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+
+
+# Picks the encoding with the highest q-value the client accepts, the server's
+# preference only breaks ties. Returns None for identity.
+def negotiate(accept_encoding):
+    qvalues = {}
+    for item in (accept_encoding or "").split(","):
+        name, *params = item.split(";")
+        qvalue = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        if name.strip():
+            qvalues[name.strip().lower()] = qvalue
+
+    ranked = [
+        (qvalues.get(encoding, qvalues.get("*", 0.0)), -preference, encoding)
+        for preference, encoding in enumerate(supported_encodings())
+    ]
+    qvalue, _, encoding = max(ranked)
+    return encoding if qvalue > 0 else None
+
+
+def compress(data, encoding):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    return data
+
+
+class UnsupportedCompression(ValueError):
+    pass
+
+
+# Errors raised while reading from open_decompressed() on invalid input
+DECOMPRESSION_ERRORS = (EOFError, zlib.error, gzip.BadGzipFile) + (
+    (zstandard.ZstdError,) if zstandard is not None else ()
+)
+
+
+# Returns a file object reading the decompressed content of the seekable
+# `fileobj`, or None if it is not compressed in a supported format. Reads are
+# bounded by their size argument and span concatenated gzip members or zstd
+# frames.
+def open_decompressed(fileobj):
+    head = fileobj.read(MAGIC_SIZE)
+    fileobj.seek(0)
+    if head.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+    if head.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise UnsupportedCompression(
+                "zstd compressed data requires the zstandard package"
+            )
+        return zstandard.ZstdDecompressor().stream_reader(
+            fileobj, read_across_frames=True, closefd=False
+        )
+    return None
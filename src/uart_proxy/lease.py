@@ -0,0 +1,174 @@
+#
+# Copyright (C) 2024, HENSOLDT Cyber GmbH
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+# For commercial licensing, contact: info.cyber@hensoldt.net
+#
+
+
+import asyncio
+import collections
+import secrets
+import time
+
+# ===============================================================================
+# DEVICE LEASING
+# ===============================================================================
+
+
+class Lease:
+    def __init__(self, holder: str, ttl: float):
+        self.token = secrets.token_hex(16)
+        self.holder = holder
+        self.renew(ttl)
+
+    def renew(self, ttl: float):
+        self.ttl = ttl
+        self.expires = time.monotonic() + ttl
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def info(self):
+        return {
+            "token": self.token,
+            "holder": self.holder,
+            "expires_in": self.remaining(),
+        }
+
+
+class DeviceLease:
+    """Exclusive reservation of a device with a fair FIFO queue of waiters.
+
+    A lease is handed to the next waiter as soon as the current one is
+    released or its TTL runs out, waiters are woken up through their future
+    instead of polling. `on_change` is called with the new lease, or None,
+    whenever the holder changes.
+    """
+
+    def __init__(self, device: str, on_change=None):
+        self.device = device
+        self.lease = None
+        self.waiters = collections.deque()
+        self.closed = False
+        self.on_change = on_change
+        self.__expiry = None
+
+    def __changed(self):
+        if self.on_change is not None:
+            self.on_change(self.lease)
+
+    def __grant(self, holder, ttl):
+        self.lease = Lease(holder, ttl)
+        self.__schedule_expiry()
+        print(f"Lease for {self.device} granted to {holder} for {ttl}s")
+        self.__changed()
+        return self.lease
+
+    def __schedule_expiry(self):
+        if self.__expiry is not None:
+            self.__expiry.cancel()
+        self.__expiry = asyncio.get_running_loop().call_later(
+            self.lease.ttl, self.__expire, self.lease.token
+        )
+
+    def __expire(self, token):
+        if self.check(token):
+            print(f"Lease for {self.device} held by {self.lease.holder} expired")
+            self.__hand_over()
+
+    def __hand_over(self):
+        if self.__expiry is not None:
+            self.__expiry.cancel()
+            self.__expiry = None
+        self.lease = None
+
+        while self.waiters:
+            holder, ttl, future = self.waiters.popleft()
+            if future.done():
+                continue
+            future.set_result(self.__grant(holder, ttl))
+            return
+        self.__changed()
+
+    def is_leased(self):
+        return self.lease is not None
+
+    def check(self, token):
+        # Headers are decoded as latin-1, compare_digest only takes ASCII str
+        if self.lease is None or token is None or not token.isascii():
+            return False
+        return secrets.compare_digest(self.lease.token, token)
+
+    def position(self, future):
+        waiting = [f for _, _, f in self.waiters if not f.done()]
+        return waiting.index(future) + 1 if future in waiting else 0
+
+    def try_acquire(self, holder: str, ttl: float):
+        if self.lease is None and not self.waiters and not self.closed:
+            return self.__grant(holder, ttl)
+        return None
+
+    def enqueue(self, holder: str, ttl: float):
+        future = asyncio.get_running_loop().create_future()
+        if self.closed:
+            future.cancel()
+        else:
+            self.waiters.append((holder, ttl, future))
+        return future
+
+    async def wait(self, future, timeout=None):
+        try:
+            await asyncio.wait({future}, timeout=timeout)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Lease was granted while the waiter went away, pass it on
+                self.release(future.result().token)
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+                self.waiters = collections.deque(
+                    w for w in self.waiters if w[2] is not future
+                )
+
+        return None if future.cancelled() else future.result()
+
+    async def acquire(self, holder: str, ttl: float, timeout=None):
+        if (lease := self.try_acquire(holder, ttl)) is not None:
+            return lease
+        return await self.wait(self.enqueue(holder, ttl), timeout)
+
+    def renew(self, token, ttl: float):
+        if not self.check(token):
+            return False
+        self.lease.renew(ttl)
+        self.__schedule_expiry()
+        return True
+
+    def release(self, token):
+        if not self.check(token):
+            return False
+        print(f"Lease for {self.device} released by {self.lease.holder}")
+        self.__hand_over()
+        return True
+
+    # Drops the lease and wakes every waiter without a lease, used when the
+    # device is removed
+    def close(self):
+        self.closed = True
+        if self.__expiry is not None:
+            self.__expiry.cancel()
+            self.__expiry = None
+        self.lease = None
+        while self.waiters:
+            self.waiters.popleft()[2].cancel()
+
+    def status(self):
+        return {
+            "leased": self.is_leased(),
+            "holder": self.lease.holder if self.lease else None,
+            "expires_in": self.lease.remaining() if self.lease else None,
+            "waiting": len([w for w in self.waiters if not w[2].done()]),
+        }
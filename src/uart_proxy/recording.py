@@ -0,0 +1,174 @@
+#
+# Copyright (C) 2024, HENSOLDT Cyber GmbH
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+# For commercial licensing, contact: info.cyber@hensoldt.net
+#
+
+
+import asyncio
+import fcntl
+import os
+import struct
+import termios
+import time
+import tty
+
+from .tty_usb import TTY_USB
+
+# ===============================================================================
+# DATA UART SESSION RECORDING
+# ===============================================================================
+#
+# A recording starts with MAGIC followed by records of
+#   <offset in us since start: u64> <direction: u8> <length: u32> <data>
+# all little endian.
+
+MAGIC = b"UPRC\x01"
+RECORD = struct.Struct("<QBI")
+
+FROM_UART = 0
+TO_UART = 1
+
+
+class SessionRecorder:
+    # Consecutive data of the same direction arriving within `coalesce`
+    # seconds is merged into one record.
+    def __init__(self, path, coalesce=0.01):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.coalesce = coalesce
+        self.file = open(path, "xb")
+        self.file.write(MAGIC)
+        self.start = time.monotonic()
+        self.direction, self.offset, self.last = None, 0, 0
+        self.data = bytearray()
+
+    def record(self, direction, data):
+        now = time.monotonic() - self.start
+        if direction != self.direction or now - self.last > self.coalesce:
+            self.__flush()
+            self.direction, self.offset = direction, now
+        self.last = now
+        self.data += data
+
+    def __flush(self):
+        if self.data:
+            self.file.write(
+                RECORD.pack(int(self.offset * 1e6), self.direction, len(self.data))
+            )
+            self.file.write(self.data)
+            self.data = bytearray()
+
+    def close(self):
+        if self.file is not None:
+            self.__flush()
+            self.file.close()
+            self.file = None
+
+
+def is_recording(path):
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+# A recording cut short, e.g. by a crash of the proxy before the recorder was
+# closed, ends at its last complete record
+def read_recording(path):
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a data uart recording")
+        while header := file.read(RECORD.size):
+            if len(header) < RECORD.size:
+                print(f"Recording {path} is truncated")
+                return
+            offset, direction, length = RECORD.unpack(header)
+            data = file.read(length)
+            if len(data) < length:
+                print(f"Recording {path} is truncated")
+                return
+            yield offset / 1e6, direction, data
+
+
+# ===============================================================================
+# REPLAY
+# ===============================================================================
+
+
+def open_pty():
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    os.set_blocking(master, False)
+    return master, slave, TTY_USB(os.ttyname(slave), None, None, None, None, "pty")
+
+
+async def _wait_fd(add, remove, fd):
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    add(fd, lambda: ready.done() or ready.set_result(None))
+    try:
+        await ready
+    finally:
+        remove(fd)
+
+
+async def _write_all(fd, data):
+    loop = asyncio.get_running_loop()
+    view = memoryview(data)
+    while view:
+        try:
+            view = view[os.write(fd, view) :]
+        except BlockingIOError:
+            await _wait_fd(loop.add_writer, loop.remove_writer, fd)
+
+
+# Waits until the other end of the pty read everything written to `fd`
+async def _wait_drained(fd, interval=0.01):
+    while struct.unpack("i", fcntl.ioctl(fd, termios.FIONREAD, b"\0" * 4))[0]:
+        await asyncio.sleep(interval)
+
+
+async def _read_exactly(fd, length):
+    loop = asyncio.get_running_loop()
+    data = bytearray()
+    while len(data) < length:
+        try:
+            data += os.read(fd, length - len(data))
+        except BlockingIOError:
+            await _wait_fd(loop.add_reader, loop.remove_reader, fd)
+    return bytes(data)
+
+
+class SessionReplay:
+    """Plays the board side of a recorded session on the master end of a pty.
+
+    Recorded uart output is written back at the original pace divided by
+    `speed`, or as fast as possible if `speed` is 0. Before continuing past a
+    recorded client message the replay waits until the client sent as many
+    bytes, so the session stays deterministic regardless of timing.
+    """
+
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        self.speed = speed
+
+    async def run(self, master, slave):
+        start = time.monotonic()
+        for offset, direction, data in read_recording(self.path):
+            if direction == TO_UART:
+                received = await _read_exactly(master, len(data))
+                if received != data:
+                    print(f"Replay of {self.path} diverged at {offset:.6f}s")
+                # Keep the pacing relative to the client's answer
+                if self.speed > 0:
+                    start = time.monotonic() - offset / self.speed
+                continue
+
+            if self.speed > 0:
+                delay = start + offset / self.speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await _write_all(master, data)
+        await _wait_drained(slave)
+        print(f"Replay of {self.path} finished")
@@ -11,16 +11,33 @@ import asyncio
 import os
 import pathlib
 import subprocess
+import tempfile
+
+from .compression import (
+    DECOMPRESSION_ERRORS,
+    UnsupportedCompression,
+    open_decompressed,
+)
 
 # ===============================================================================
 # TFTP BOOT
 # ===============================================================================
 
 
+# An upload the client has to fix, carries the status code to answer with
+class ImageError(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
 class TFTP:
-    def __init__(self, tftp_folder="/tftpboot/"):
+    def __init__(self, tftp_folder="/tftpboot/", max_image_size=512 * 1024 * 1024):
         self.tftp_folder = tftp_folder
         self.trentos_image_name = "os_image.elf"
+        self.compressed_suffixes = ("", ".gz", ".zst")
+        self.max_image_size = max_image_size
 
     reply = {}
 
@@ -63,7 +80,33 @@ class TFTP:
         }
 
     def __validate_file(self, filename):
-        return filename != self.trentos_image_name
+        return filename not in (
+            self.trentos_image_name + suffix for suffix in self.compressed_suffixes
+        )
+
+    # Copies the spooled upload in bounded chunks, gzip or zstd compressed
+    # images are detected by their magic and decompressed on the fly. Blocks,
+    # so it runs in an executor.
+    def __write_image(self, source, tftp_file, chunk_size=1024 * 1024):
+        try:
+            reader = open_decompressed(source) or source
+        except UnsupportedCompression as e:
+            raise ImageError(415, str(e))
+
+        size = 0
+        while True:
+            try:
+                chunk = reader.read(chunk_size)
+            except DECOMPRESSION_ERRORS as e:
+                raise ImageError(422, f"Compressed image is invalid: {e}")
+            if not chunk:
+                return
+            size += len(chunk)
+            if size > self.max_image_size:
+                raise ImageError(
+                    413, f"Image exceeds the limit of {self.max_image_size} bytes"
+                )
+            tftp_file.write(chunk)
 
     async def upload(self, device, file):
         if self.__validate_file(file.filename):
@@ -75,13 +118,31 @@ class TFTP:
         file_location = (
             pathlib.Path(self.tftp_folder) / device / self.trentos_image_name
         )
+        # Replace the image only once it was written completely, every upload
+        # gets its own temporary file
+        partial_location = None
         try:
-            with open(file_location, "wb") as tftp_file:
-                tftp_file.write(await file.read())
+            with tempfile.NamedTemporaryFile(
+                dir=file_location.parent,
+                prefix=f".{self.trentos_image_name}.",
+                delete=False,
+            ) as tftp_file:
+                partial_location = tftp_file.name
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.__write_image, file.file, tftp_file
+                )
+            os.chmod(partial_location, 0o644)
+            os.replace(partial_location, file_location)
             return (200, "Upload successfull")
+        except ImageError as e:
+            print(f"Rejected upload for {device}: {e.detail}")
+            return (e.status_code, e.detail)
         except Exception as e:
             print(f"Exception during file processing occured: {e}")
             return (500, "Saving file saved due to server error")
+        finally:
+            if partial_location is not None and os.path.exists(partial_location):
+                os.remove(partial_location)
 
     def delete(self, device):
         file_location = (
@@ -8,6 +8,8 @@
 
 
 import asyncio
+import collections
+import time
 from enum import Enum
 
 import serial
@@ -26,16 +28,24 @@ class UART_STATE(Enum):
 
 
 class Uart:
-    def __init__(self, device: str, serial: str, usb_path: str):
+    def __init__(self, device: str, serial: str, usb_path: str, tty: TTY_USB = None):
         self.reader, self.writer = None, None
         self.device = device
         self.serial = serial
         self.usb_path = usb_path
-        self.find_uart_device()
+        if tty is None:
+            self.find_uart_device()
+        else:
+            self.uart = tty
+            self.state = UART_STATE.UNINITIALIZED
 
     def __del__(self):
+        self.close()
+
+    def close(self):
         if self.writer is not None:
             self.writer.close()
+            self.writer = None
 
     async def open_port(self):
         try:
@@ -66,28 +76,130 @@ class Uart:
 
 
 class LogUart(Uart):
-    def __init__(self, device: str, serial: str, usb_path: str):
+    RAW_CHUNK_SIZE = 4096
+
+    # In raw mode the uart is read in chunks as they arrive instead of waiting
+    # for a newline, lines are only split off when a consumer asks for them.
+    # In both modes lines are cut at max_line_length.
+    def __init__(
+        self,
+        device: str,
+        serial: str,
+        usb_path: str,
+        raw: bool = False,
+        idle_flush: float = 0.5,
+        max_line_length: int = 4096,
+    ):
         super().__init__(device, serial, usb_path)
 
+        self.raw = raw
+        self.idle_flush = idle_flush
+        self.max_line_length = max_line_length
         self.queue = asyncio.Queue()
         self.reading_state = asyncio.Event()
+        self.read_task = None
+        self.flush_pending()
 
     async def read_from_uart(self):
         while True:
             await self.reading_state.wait()
-            line = await self.reader.readline()
-            if line:
-                await self.queue.put(line)
+            if self.raw:
+                data = await self.reader.read(self.RAW_CHUNK_SIZE)
+            else:
+                data = await self.__read_line()
+            if not data:
+                print(f"UART of {self.device} closed")
+                self.reading_state.clear()
+                self.state = UART_STATE.ERROR
+                return
+
+            if self.raw:
+                await self.queue.put((time.time(), data))
+                continue
+            timestamp = time.time()
+            for start in range(0, len(data), self.max_line_length):
+                await self.queue.put(
+                    (timestamp, data[start : start + self.max_line_length])
+                )
+
+    # Unlike readline() this neither drops nor fails on lines exceeding the
+    # stream's buffer limit, they are returned in pieces instead
+    async def __read_line(self):
+        try:
+            return await self.reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+        except asyncio.LimitOverrunError as e:
+            # consumed is the separator's position if it is already buffered,
+            # else the buffer length. read() only returns what is buffered,
+            # so one more byte takes the separator along without waiting.
+            return await self.reader.read(e.consumed + 1)
+
+    def flush(self):
+        self.queue = asyncio.Queue()
+        self.flush_pending()
+
+    def flush_pending(self):
+        self.pending = bytearray()
+        # [timestamp, length] of the chunks making up pending
+        self.pending_chunks = collections.deque()
+        self.last_chunk = None
+
+    def __take_pending(self, length):
+        data = bytes(self.pending[:length])
+        del self.pending[:length]
+        while length > 0:
+            chunk = self.pending_chunks[0]
+            if chunk[1] > length:
+                chunk[1] -= length
+                break
+            length -= chunk[1]
+            self.pending_chunks.popleft()
+        return data
+
+    # Returns the next line, or None if there is no complete line yet. In raw
+    # mode an unterminated rest is handed out once no new data arrived for
+    # idle_flush seconds.
+    def get_line(self):
+        if not self.raw:
+            return None if self.queue.empty() else self.queue.get_nowait()[1]
+
+        while True:
+            end = self.pending.find(b"\n", 0, self.max_line_length)
+            if end >= 0:
+                return self.__take_pending(end + 1)
+            if len(self.pending) >= self.max_line_length:
+                return self.__take_pending(self.max_line_length)
+            if self.queue.empty():
+                break
+            self.last_chunk, chunk = self.queue.get_nowait()
+            self.pending_chunks.append([self.last_chunk, len(chunk)])
+            self.pending += chunk
+
+        if self.pending and time.time() - self.last_chunk >= self.idle_flush:
+            return self.__take_pending(len(self.pending))
+        return None
+
+    # Returns everything received so far as (timestamp, data) chunks without
+    # any line framing
+    def get_chunks(self):
+        chunks = []
+        while self.pending_chunks:
+            timestamp, length = self.pending_chunks[0]
+            chunks.append((timestamp, self.__take_pending(length)))
+        while not self.queue.empty():
+            chunks.append(self.queue.get_nowait())
+        return chunks
 
     def is_reading(self):
         return self.reading_state.is_set()
 
     async def initialize_uart_reading(self):
         await self.open_port()
-        asyncio.create_task(self.read_from_uart())
+        self.read_task = asyncio.create_task(self.read_from_uart())
 
     async def start_reading(self):
-        self.queue = asyncio.Queue() #Flush queue
+        self.flush()
 
         if self.state is UART_STATE.UNINITIALIZED:
             print("UART not initialized, trying initialization")
@@ -106,11 +218,75 @@ class LogUart(Uart):
         self.reading_state.clear()
         self.state = UART_STATE.CONNECTED
 
+    def close(self):
+        if getattr(self, "read_task", None) is not None:
+            self.read_task.cancel()
+            self.read_task = None
+        super().close()
+
+
+class BoundedBuffer:
+    """Byte buffer between a producer and a consumer task.
+
+    Once the buffer holds `high_watermark` bytes the producer is paused in
+    put() until the consumer drained it to `low_watermark`. Larger data is
+    added piecewise, so the buffer never holds more than `high_watermark`.
+    """
+
+    def __init__(self, high_watermark: int, low_watermark: int):
+        self.high_watermark = max(1, high_watermark)
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.data = bytearray()
+        self.readable = asyncio.Event()
+        self.writable = asyncio.Event()
+        self.writable.set()
+        self.total = 0
+        self.peak = 0
+        self.pauses = 0
+
+    async def put(self, data):
+        view = memoryview(data)
+        while view:
+            await self.writable.wait()
+            piece = view[: self.high_watermark - len(self.data)]
+            view = view[len(piece) :]
+            self.data += piece
+            self.total += len(piece)
+            self.peak = max(self.peak, len(self.data))
+            self.readable.set()
+            if len(self.data) >= self.high_watermark:
+                self.writable.clear()
+                self.pauses += 1
+
+    # Returns everything buffered, at most max_size bytes if given
+    async def get(self, max_size=None):
+        await self.readable.wait()
+        size = len(self.data) if max_size is None else max_size
+        data = bytes(self.data[:size])
+        del self.data[:size]
+        if not self.data:
+            self.readable.clear()
+        if len(self.data) <= self.low_watermark:
+            self.writable.set()
+        return data
+
+    def stats(self):
+        return {
+            "buffered": len(self.data),
+            "high_watermark": self.high_watermark,
+            "low_watermark": self.low_watermark,
+            "peak": self.peak,
+            "total": self.total,
+            "paused": not self.writable.is_set(),
+            "pauses": self.pauses,
+        }
+
 
 class DataUart(Uart):
+    CHUNK_SIZE = 4096
+
     async def read(self, callback):
-        while True:
-            data = await self.reader.read(1)
+        while data := await self.reader.read(self.CHUNK_SIZE):
             await callback(data)
 
     async def write(self, data):
@@ -9,11 +9,19 @@
 import json
 import base64
 import asyncio
+import datetime
+import itertools
 import os
+import pathlib
+import signal
 from fastapi import (
     FastAPI,
     HTTPException,
     File,
+    Header,
+    Query,
+    Request,
+    Response,
     UploadFile,
     WebSocket,
     WebSocketDisconnect,
@@ -22,8 +30,18 @@ from fastapi.responses import JSONResponse
 
 import requests
 
+from . import compression
+from .lease import DeviceLease
+from .recording import (
+    FROM_UART,
+    TO_UART,
+    SessionRecorder,
+    SessionReplay,
+    is_recording,
+    open_pty,
+)
 from .tftp import TFTP
-from .uart import LogUart, DataUart
+from .uart import BoundedBuffer, LogUart, DataUart
 
 
 # ===============================================================================
@@ -39,10 +57,23 @@ class Device:
         self.__config = config
         self.name = device["name"]
         self.poe_id = device["poe_id"]
-        self.uart = LogUart(
-            self.name, device["uart"]["serialid"], device["uart"]["usb_path"]
-        )
+        self.uart = self.__log_uart(device)
         self.has_data_uart = "data_uart" in device
+        self.lease = DeviceLease(self.name, self.__lease_changed)
+        self.data_uart_sessions = {}
+        self.__session_stops = {}
+        self.__session_ids = itertools.count(1)
+
+    def __log_uart(self, device):
+        uart = device["uart"]
+        return LogUart(
+            self.name,
+            uart["serialid"],
+            uart["usb_path"],
+            raw=uart.get("raw", False),
+            idle_flush=uart.get("idle_flush", 0.5),
+            max_line_length=uart.get("max_line_length", 4096),
+        )
 
     def print_info(self):
         power_state = "Error" if (ps := self.power_state()) is None else ps
@@ -50,8 +81,72 @@ class Device:
             **self.__device,
             "reading": self.uart.is_reading(),
             "power_state": power_state,
+            "lease": self.lease.status(),
         }
 
+    # Returns the log uart a changed device entry needs, None if the current
+    # one and its buffered lines can be kept
+    def prepare_update(self, device):
+        if device["uart"] == self.__device["uart"]:
+            return None
+        return self.__log_uart(device)
+
+    # Applies a changed device entry in place with the log uart built by
+    # prepare_update()
+    def update(self, device, config, uart=None):
+        self.__config = config
+        if device == self.__device:
+            return False
+
+        if uart is not None:
+            self.uart.close()
+            self.uart = uart
+        self.__device = device
+        self.poe_id = device["poe_id"]
+        self.has_data_uart = "data_uart" in device
+        return True
+
+    # Ends the data uart sessions matching `predicate`, the session closes
+    # its websocket with `code` and `reason`
+    def __stop_sessions(self, predicate, code, reason):
+        for stop in self.__session_stops.values():
+            if predicate(stop) and not stop["event"].is_set():
+                stop["close"] = (code, reason)
+                stop["event"].set()
+
+    # A new holder must neither share the data uart with sessions opened
+    # under another lease nor read log lines buffered for the previous one
+    def __lease_changed(self, lease):
+        def foreign(stop):
+            if not stop["board"]:
+                return False
+            if lease is None:
+                return stop["token"] is not None
+            return not self.lease.check(stop["token"])
+
+        self.__stop_sessions(foreign, 4003, "Lease of the device changed")
+        if self.uart.is_reading():
+            self.uart.stop_reading()
+        self.uart.flush()
+
+    # Closes the log uart, drops the lease and its waiters and ends all open
+    # data uart sessions
+    def close(self):
+        self.uart.close()
+        self.lease.close()
+        self.__stop_sessions(lambda stop: True, 4005, "Device was removed")
+
+    # Returns (status_code, reason) if the token does not grant access. The
+    # holder is named on purpose, it is public in /info and lease/state too
+    # and tells a blocked CI job whom it is waiting for.
+    def lease_error(self, token):
+        if self.lease.is_leased():
+            if not self.lease.check(token):
+                return (423, f"Device is leased by {self.lease.lease.holder}")
+        elif self.__config.get("require_lease", False):
+            return (428, "A lease is required to access this device")
+        return None
+
     def power_state(self):
         poe = self.__config["poe_switch"]
         url = f"{poe['url']}/rest/interface/ethernet/poe"
@@ -79,7 +174,19 @@ class Device:
     def power_off(self):
         return self.__switch_power_set("off").ok
 
-    async def data_uart(self, websocket):
+    def recording_folder(self):
+        folder = self.__config.get("recording_folder", "/var/lib/uart_proxy/recordings")
+        return pathlib.Path(folder) / self.name
+
+    def recordings(self):
+        folder = self.recording_folder()
+        if not os.path.exists(folder):
+            return []
+        return sorted(f for f in os.listdir(folder) if f.endswith(".rec"))
+
+    # `token` is the lease token the session was opened with, None if the
+    # device was not leased
+    async def data_uart(self, websocket, record=False, token=None):
         if not self.has_data_uart:
             print(
                 f"Data Uart not configured for {self.name}, websocket connection failed."
@@ -96,29 +203,167 @@ class Device:
             self.__device["data_uart"]["serialid"],
             self.__device["data_uart"]["usb_path"],
         )
+        recorder = None
+        if record:
+            name = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f.rec")
+            try:
+                recorder = SessionRecorder(self.recording_folder() / name)
+            except OSError as e:
+                print(f"Recording Data Uart session of {self.name} failed: {e}")
+                await websocket.close(code=4006, reason="Recording not possible")
+                return
+            print(f"Recording Data Uart session of {self.name} to {recorder.path}")
+
+        try:
+            await self.bridge_data_uart(websocket, data_uart, recorder, token)
+        finally:
+            if recorder is not None:
+                recorder.close()
+
+    # Returns why `recording` cannot be replayed, None if it can
+    def recording_error(self, recording):
+        if recording not in self.recordings():
+            return "Recording not found"
+        try:
+            if not is_recording(self.recording_folder() / recording):
+                return "Not a data uart recording"
+        except OSError as e:
+            return f"Recording not readable: {e}"
+        return None
+
+    # Serves a recorded session through a pty backed data uart instead of the
+    # board, see SessionReplay. The session ends with the replay.
+    async def replay_data_uart(self, websocket, recording, speed):
+        print(f"Replaying {recording} for {self.name} at speed {speed}")
+        master, slave, pty = open_pty()
+        data_uart = DataUart(self.name, None, None, tty=pty)
+        replay = SessionReplay(self.recording_folder() / recording, speed)
+        replay_task = asyncio.create_task(replay.run(master, slave))
+        try:
+            await self.bridge_data_uart(
+                websocket, data_uart, board=False, until=replay_task
+            )
+        finally:
+            try:
+                replay_task.cancel()
+                try:
+                    await replay_task
+                except asyncio.CancelledError:
+                    pass
+                except Exception:
+                    pass  # Reported by bridge_data_uart
+            finally:
+                data_uart.close()
+                os.close(master)
+                os.close(slave)
+
+    def __data_uart_buffer(self):
+        data_uart = self.__device.get("data_uart", {})
+        return BoundedBuffer(
+            data_uart.get("high_watermark", 64 * 1024),
+            data_uart.get("low_watermark", 16 * 1024),
+        )
+
+    # Bridges websocket and uart through a bounded buffer per direction. A
+    # full buffer pauses its producer, so a slow websocket client stops the
+    # uart from being read and a slow uart stops receiving from the websocket.
+    # Sessions with `board` set are ended when the lease changes, see
+    # __lease_changed(). If `until` is given the session ends once that task
+    # is done, after the uart output so far was passed on.
+    async def bridge_data_uart(
+        self, websocket, data_uart, recorder=None, token=None, board=True, until=None
+    ):
         await data_uart.open_port()
 
+        to_websocket = self.__data_uart_buffer()
+        to_uart = self.__data_uart_buffer()
+        session = next(self.__session_ids)
+        self.data_uart_sessions[session] = {
+            "to_websocket": to_websocket,
+            "to_uart": to_uart,
+        }
+        stop = {"event": asyncio.Event(), "token": token, "board": board}
+        self.__session_stops[session] = stop
+
         async def uart_callback(data):
-            await websocket.send_bytes(data)
+            if recorder is not None:
+                recorder.record(FROM_UART, data)
+            await to_websocket.put(data)
 
-        # Uart read loops, this will run until the websocket disconnects
-        uart_read_task = asyncio.create_task(data_uart.read(uart_callback))
+        async def send_to_websocket():
+            while True:
+                await websocket.send_bytes(
+                    await to_websocket.get(to_websocket.high_watermark)
+                )
 
-        try:
+        async def receive_from_websocket():
             while True:
                 data = await websocket.receive_bytes()
-                await data_uart.write(data)
+                if recorder is not None:
+                    recorder.record(TO_UART, data)
+                await to_uart.put(data)
+
+        async def write_to_uart():
+            while True:
+                await data_uart.write(await to_uart.get())
+
+        async def drain_to_websocket(settle=0.05):
+            idle = 0
+            while idle < 2:
+                await asyncio.sleep(settle)
+                idle = 0 if to_websocket.data else idle + 1
+
+        # These run until the websocket disconnects, one of them fails or the
+        # device is removed
+        tasks = [
+            asyncio.create_task(coroutine)
+            for coroutine in (
+                data_uart.read(uart_callback),
+                send_to_websocket(),
+                receive_from_websocket(),
+                write_to_uart(),
+                stop["event"].wait(),
+            )
+        ]
+
+        try:
+            done, _ = await asyncio.wait(
+                tasks + ([until] if until is not None else []),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if until in done:
+                if until.exception() is None:
+                    await drain_to_websocket()
+                    print(f"Data Uart session of {self.name} finished")
+                    await websocket.close(code=1000, reason="Session finished")
+                else:
+                    reason = f"Session failed: {until.exception()}"
+                    print(f"Data Uart session of {self.name}: {reason}")
+                    await websocket.close(code=4007, reason=reason[:120])
+                done.discard(until)
+            for task in done:
+                task.result()
+            if stop["event"].is_set():
+                code, reason = stop["close"]
+                print(f"Closing Data Uart session of {self.name}: {reason}")
+                await websocket.close(code=code, reason=reason)
 
         except WebSocketDisconnect:
             print(f"Data Uart Websocket disconnected for {self.name} disconnected.")
         except Exception as e:
             print(f"Unexpected error in handling data Uart websocket: {e}")
         finally:
-            uart_read_task.cancel()
-            try:
-                await uart_read_task
-            except asyncio.CancelledError:
-                pass
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            del self.data_uart_sessions[session]
+            del self.__session_stops[session]
+
+    def data_uart_stats(self):
+        return {
+            session: {name: buffer.stats() for name, buffer in buffers.items()}
+            for session, buffers in self.data_uart_sessions.items()
+        }
 
     @staticmethod
     def get_device(device):
@@ -126,6 +371,13 @@ class Device:
             raise HTTPException(status_code=404, detail="Device not found")
         return devices[device]
 
+    @staticmethod
+    def get_leased_device(device, token):
+        dev = Device.get_device(device)
+        if (error := dev.lease_error(token)) is not None:
+            raise HTTPException(status_code=error[0], detail=error[1])
+        return dev
+
 
 # ===============================================================================
 # Config
@@ -139,6 +391,7 @@ class Config:
             print(f"ERROR: Config file at {config_file} not found")
             exit(-1)
 
+        self.config_file = config_file
         with open(config_file, "r") as file:
             self.config = json.load(file)
             self.ip = self.config["ip"]
@@ -147,6 +400,37 @@ class Config:
     async def get_devices(self):
         return {dev["name"]: Device(dev, self.config) for dev in self.config["devices"]}
 
+    # Re-reads and validates the config file without applying it, ip and port
+    # only take effect after a restart
+    def read(self):
+        with open(self.config_file, "r") as file:
+            new_config = json.load(file)
+        if not isinstance(new_config, dict) or not isinstance(
+            new_config.get("devices"), list
+        ):
+            raise ValueError("The configuration needs a list of devices")
+        if not isinstance(new_config.get("poe_switch"), dict):
+            raise ValueError("The configuration needs a poe_switch")
+
+        names = set()
+        for dev in new_config["devices"]:
+            if not isinstance(dev, dict):
+                raise ValueError(f"Device entry {dev} is not an object")
+            if missing := {"name", "poe_id", "uart"} - dev.keys():
+                raise ValueError(f"Device entry {dev} is missing {sorted(missing)}")
+            for uart in ("uart", "data_uart"):
+                if uart in dev and (
+                    not isinstance(dev[uart], dict)
+                    or {"serialid", "usb_path"} - dev[uart].keys()
+                ):
+                    raise ValueError(
+                        f"{uart} of device {dev['name']} needs serialid and usb_path"
+                    )
+            if dev["name"] in names:
+                raise ValueError(f"Device {dev['name']} is configured twice")
+            names.add(dev["name"])
+        return new_config
+
     # Returns a safe copy of the config without credentials
     def get_clean_config(self):
         return {
@@ -173,12 +457,88 @@ def get_config():
 app = FastAPI()
 devices = None
 tftp = TFTP()
+reload_lock = None
+# The loop only keeps weak references to tasks, hold signal triggered ones here
+background_tasks = set()
+
+DEFAULT_LEASE_TTL = 600
+MIN_COMPRESSION_SIZE = 1024
+
+
+async def wait_for_disconnect(request: Request, interval=1.0):
+    while not await request.is_disconnected():
+        await asyncio.sleep(interval)
+
+
+# JSON response compressed with the encoding negotiated via Accept-Encoding
+def compressed_json_response(request: Request, content):
+    body = json.dumps(content).encode("utf-8")
+    encoding = compression.negotiate(request.headers.get("accept-encoding"))
+    if encoding is None or len(body) < MIN_COMPRESSION_SIZE:
+        return JSONResponse(content=content)
+    return Response(
+        content=compression.compress(body, encoding),
+        media_type="application/json",
+        headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"},
+    )
+
+
+async def reload_devices():
+    async with reload_lock:
+        new_config = get_config().read()
+        new_devices = {dev["name"]: dev for dev in new_config["devices"]}
+        diff = {"added": [], "removed": [], "changed": []}
+
+        # Build everything first, a failure leaves the running devices as is
+        added = {
+            name: Device(dev, new_config)
+            for name, dev in new_devices.items()
+            if name not in devices
+        }
+        uarts = {
+            name: devices[name].prepare_update(dev)
+            for name, dev in new_devices.items()
+            if name in devices
+        }
+
+        for name in list(devices):
+            if name not in new_devices:
+                devices.pop(name).close()
+                diff["removed"].append(name)
+
+        for name, dev in new_devices.items():
+            if name in added:
+                devices[name] = added[name]
+                diff["added"].append(name)
+            elif devices[name].update(dev, new_config, uarts[name]):
+                diff["changed"].append(name)
+        get_config().config = new_config
+
+        print(f"Configuration reloaded: {diff}")
+        return diff
+
+
+async def reload_devices_on_signal():
+    try:
+        await reload_devices()
+    except Exception as e:
+        print(f"Reloading configuration failed, keeping current devices: {e}")
+
+
+def start_background_task(coroutine):
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
 
 
 @app.on_event("startup")
 async def startup_event():
-    global devices
+    global devices, reload_lock
     devices = await get_config().get_devices()
+    reload_lock = asyncio.Lock()
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGHUP, lambda: start_background_task(reload_devices_on_signal())
+    )
 
 
 @app.get("/{device}/info")
@@ -194,6 +554,125 @@ async def get_loaded_config():
     return JSONResponse(content=config.get_clean_config())
 
 
+@app.post("/config/reload")
+async def reload_loaded_config():
+    try:
+        diff = await reload_devices()
+    except Exception as e:
+        print(f"Reloading configuration failed, keeping current devices: {e}")
+        raise HTTPException(status_code=422, detail=f"Invalid configuration: {e}")
+    return JSONResponse(content=diff)
+
+
+## Lease
+@app.get("/{device}/lease/state")
+async def device_lease_state(device: str):
+    return JSONResponse(content=Device.get_device(device).lease.status())
+
+
+@app.post("/{device}/lease/acquire")
+async def device_lease_acquire(
+    device: str,
+    request: Request,
+    holder: str,
+    ttl: float = Query(DEFAULT_LEASE_TTL, gt=0),
+    timeout: float = Query(0, ge=0),
+):
+    dev = Device.get_device(device)
+    if timeout == 0:
+        lease = dev.lease.try_acquire(holder, ttl)
+    else:
+        # Stop waiting if the client goes away, a lease granted to it would
+        # block the device for its whole TTL
+        acquire_task = asyncio.create_task(dev.lease.acquire(holder, ttl, timeout))
+        disconnect_task = asyncio.create_task(wait_for_disconnect(request))
+        await asyncio.wait(
+            {acquire_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED
+        )
+        if disconnect_task.done():
+            print(f"Lease waiter {holder} for {device} disconnected.")
+            acquire_task.cancel()
+            try:
+                if (lease := await acquire_task) is not None:
+                    dev.lease.release(lease.token)
+            except asyncio.CancelledError:
+                pass
+            return
+        disconnect_task.cancel()
+        lease = acquire_task.result()
+
+    if dev.lease.closed:
+        raise HTTPException(status_code=410, detail="Device was removed")
+    if lease is None:
+        raise HTTPException(status_code=409, detail="Device is leased")
+    return JSONResponse(content=lease.info())
+
+
+@app.post("/{device}/lease/renew")
+async def device_lease_renew(
+    device: str,
+    ttl: float = Query(DEFAULT_LEASE_TTL, gt=0),
+    x_lease_token: str = Header(None),
+):
+    dev = Device.get_device(device)
+    if not dev.lease.renew(x_lease_token, ttl):
+        raise HTTPException(status_code=423, detail="Lease token not valid")
+    return JSONResponse(content=dev.lease.lease.info())
+
+
+@app.post("/{device}/lease/release")
+async def device_lease_release(device: str, x_lease_token: str = Header(None)):
+    dev = Device.get_device(device)
+    if not dev.lease.release(x_lease_token):
+        raise HTTPException(status_code=423, detail="Lease token not valid")
+
+
+# Queues for the lease and pushes the token once it is handed over
+@app.websocket("/{device}/lease/wait")
+async def device_lease_wait(
+    device: str,
+    websocket: WebSocket,
+    holder: str,
+    ttl: float = Query(DEFAULT_LEASE_TTL, gt=0),
+):
+    await websocket.accept()
+    dev = Device.get_device(device)
+
+    lease = dev.lease.try_acquire(holder, ttl)
+    if lease is None:
+        future = dev.lease.enqueue(holder, ttl)
+        await websocket.send_json(
+            {"state": "queued", "position": dev.lease.position(future)}
+        )
+
+        # A receive only completes here if the client goes away
+        receive_task = asyncio.create_task(websocket.receive())
+        wait_task = asyncio.create_task(dev.lease.wait(future))
+        await asyncio.wait(
+            {receive_task, wait_task}, return_when=asyncio.FIRST_COMPLETED
+        )
+        receive_task.cancel()
+        if not wait_task.done():
+            print(f"Lease waiter {holder} for {device} disconnected.")
+            wait_task.cancel()
+            try:
+                await wait_task
+            except asyncio.CancelledError:
+                pass
+            return
+        lease = wait_task.result()
+        if lease is None:
+            await websocket.close(code=4005, reason="Device was removed")
+            return
+
+    try:
+        await websocket.send_json({"state": "granted", **lease.info()})
+        await websocket.close()
+    except Exception as e:
+        print(f"Lease holder {holder} for {device} unreachable, releasing: {e}")
+        dev.lease.release(lease.token)
+
+
 ## Power
 @app.post("/{device}/power/state")
 async def device_power_state(device: str):
@@ -209,16 +688,16 @@ async def device_power_state(device: str):
 
 
 @app.post("/{device}/power/on")
-async def device_power_on(device: str):
-    dev = Device.get_device(device)
+async def device_power_on(device: str, x_lease_token: str = Header(None)):
+    dev = Device.get_leased_device(device, x_lease_token)
 
     if not dev.power_on():
         raise HTTPException(status_code=502, detail="Request to switch failed")
 
 
 @app.post("/{device}/power/off")
-async def device_power_off(device: str):
-    dev = Device.get_device(device)
+async def device_power_off(device: str, x_lease_token: str = Header(None)):
+    dev = Device.get_leased_device(device, x_lease_token)
     if not dev.power_off():
         raise HTTPException(status_code=502, detail="Request to switch failed")
 
@@ -231,27 +710,45 @@ async def device_uart_state(device: str):
 
 
 @app.post("/{device}/uart/enable")
-async def device_uart_enable(device: str):
-    dev = Device.get_device(device)
+async def device_uart_enable(device: str, x_lease_token: str = Header(None)):
+    dev = Device.get_leased_device(device, x_lease_token)
     await dev.uart.start_reading()
 
 
 @app.post("/{device}/uart/disable")
-async def device_uart_disable(device: str):
-    dev = Device.get_device(device)
+async def device_uart_disable(device: str, x_lease_token: str = Header(None)):
+    dev = Device.get_leased_device(device, x_lease_token)
     dev.uart.stop_reading()
 
 
 @app.get("/{device}/uart/readline")
-async def device_uart_readline(device: str):
-    dev = Device.get_device(device)
+async def device_uart_readline(device: str, x_lease_token: str = Header(None)):
+    dev = Device.get_leased_device(device, x_lease_token)
     if not dev.uart.is_reading():
         raise HTTPException(status_code=412, detail="Uart not started")
 
-    if dev.uart.queue.empty():
+    line = dev.uart.get_line()
+    if line is None:
         raise HTTPException(status_code=202, detail="No data in the queue")
 
-    return base64.b64encode(await dev.uart.queue.get())
+    return base64.b64encode(line)
+
+
+@app.get("/{device}/uart/read")
+async def device_uart_read(
+    device: str, request: Request, x_lease_token: str = Header(None)
+):
+    dev = Device.get_leased_device(device, x_lease_token)
+    if not dev.uart.is_reading():
+        raise HTTPException(status_code=412, detail="Uart not started")
+
+    return compressed_json_response(
+        request,
+        [
+            {"time": timestamp, "data": base64.b64encode(data).decode()}
+            for timestamp, data in dev.uart.get_chunks()
+        ],
+    )
 
 
 ## Data UART
@@ -261,15 +758,54 @@ async def device_data_uart_state(device: str):
 
 
 @app.websocket("/{device}/data_uart/connect")
-async def device_data_uart_connect(device: str, websocket: WebSocket):
+async def device_data_uart_connect(
+    device: str,
+    websocket: WebSocket,
+    record: bool = False,
+    x_lease_token: str = Header(None),
+):
     print("Websocket api triggered ", device)
     try:
         await websocket.accept()
-        await Device.get_device(device).data_uart(websocket)
+        dev = Device.get_device(device)
+        if (error := dev.lease_error(x_lease_token)) is not None:
+            await websocket.close(code=4003, reason=error[1])
+            return
+        token = x_lease_token if dev.lease.is_leased() else None
+        await dev.data_uart(websocket, record, token)
     except WebSocketDisconnect:
         print(f"Websocket for {device} disconnected.")
 
 
+@app.get("/{device}/data_uart/stats")
+async def device_data_uart_stats(device: str):
+    return JSONResponse(content=Device.get_device(device).data_uart_stats())
+
+
+@app.get("/{device}/data_uart/recordings")
+async def device_data_uart_recordings(device: str):
+    return JSONResponse(content=Device.get_device(device).recordings())
+
+
+@app.websocket("/{device}/data_uart/replay/{recording}")
+async def device_data_uart_replay(
+    device: str,
+    recording: str,
+    websocket: WebSocket,
+    speed: float = Query(1.0, ge=0),
+):
+    try:
+        dev = Device.get_device(device)
+        if (error := dev.recording_error(recording)) is not None:
+            print(f"Replay of {recording} for {device} refused: {error}")
+            await websocket.close(code=4004, reason=error)
+            return
+        await websocket.accept()
+        await dev.replay_data_uart(websocket, recording, speed)
+    except WebSocketDisconnect:
+        print(f"Replay websocket for {device} disconnected.")
+
+
 ## TFTP
 @app.get("/{device}/tftp/state")
 async def device_tftp_state(device: str):
@@ -277,14 +813,18 @@ async def device_tftp_state(device: str):
 
 
 @app.post("/{device}/tftp/upload")
-async def device_tftp_upload(device: str, file: UploadFile = File(...)):
+async def device_tftp_upload(
+    device: str, file: UploadFile = File(...), x_lease_token: str = Header(None)
+):
+    Device.get_leased_device(device, x_lease_token)
     error_code, error_msg = await tftp.upload(device, file)
     if error_code != 200:
         raise HTTPException(status_code=error_code, detail=error_msg)
 
 
 @app.delete("/{device}/tftp/delete")
-async def device_tftp_delete(device: str):
+async def device_tftp_delete(device: str, x_lease_token: str = Header(None)):
+    Device.get_leased_device(device, x_lease_token)
     tftp.delete(device)
 
 